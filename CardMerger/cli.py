@@ -1,5 +1,3 @@
-from decimal import Decimal
-
 import click
 
 from CardMerger.merger import (
@@ -39,19 +37,27 @@ def MergeCards():
     default="LETTER",
     show_default=True,
 )
+@click.option(
+    "--assume-uniform-size/--no-assume-uniform-size",
+    default=True,
+    help="Assume all cards in the directory share one size",
+    show_default=True,
+)
 def merge_spell_cards(
     spell_list: str,
     path_to_pdf_directory: str,
     card_scale: float,
     paper_size: PaperSize,
+    assume_uniform_size: bool,
 ):
     print(f"Merging cards for: {spell_list}")
     print(f"Single spell pdfs at: {path_to_pdf_directory}")
     merger = CardMerger(
         path_to_card_pdfs=path_to_pdf_directory, name_filter=extract_spell_name
     )
-    merger.card_scale = Decimal(card_scale)
+    merger.card_scale = card_scale
     merger.paper_size = paper_size
+    merger.assume_uniform_size = assume_uniform_size
     merger.create_cards_file(spell_list)
 
 
@@ -79,19 +85,27 @@ def merge_spell_cards(
     default="LETTER",
     show_default=True,
 )
+@click.option(
+    "--assume-uniform-size/--no-assume-uniform-size",
+    default=True,
+    help="Assume all cards in the directory share one size",
+    show_default=True,
+)
 def merge_monster_cards(
     monster_list: str,
     path_to_pdf_directory: str,
     card_scale: float,
     paper_size: PaperSize,
+    assume_uniform_size: bool,
 ):
     print(f"Merging cards for: {monster_list}")
     print(f"Single monster pdfs at: {path_to_pdf_directory}")
     merger = CardMerger(
         path_to_card_pdfs=path_to_pdf_directory, name_filter=extract_monster_name
     )
-    merger.card_scale = Decimal(card_scale)
+    merger.card_scale = card_scale
     merger.paper_size = paper_size
+    merger.assume_uniform_size = assume_uniform_size
     merger.create_cards_file(monster_list)
 
 
@@ -1,20 +1,35 @@
-import glob
 import logging
+import mmap
 import os
 import pprint
-import re
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from decimal import Decimal
 from enum import Enum
 from typing import Callable, Collection, Dict, List, Optional, Tuple
 
-import PyPDF2 as pdf
-import PyPDF2.generic
+import pypdf
+import pypdf.generic
 
 logger = logging.getLogger(__name__)
 
-spell_file_prefix_re = re.compile("^\d*_")
-monster_file_suffix_re = re.compile("\s*\([LS]\)$")
+
+def strip_spell_file_prefix(file_name: str) -> str:
+    """Strip a leading number + underscore prefix ('^\\d*_') without regex overhead."""
+    i = 0
+    while i < len(file_name) and file_name[i].isdecimal():
+        i += 1
+    if i < len(file_name) and file_name[i] == "_":
+        return file_name[i + 1 :]
+    return file_name
+
+
+def strip_monster_file_suffix(file_name: str) -> str:
+    """Strip a trailing size designator ('\\s*\\([LS]\\)$') without regex overhead."""
+    if file_name.endswith(("(L)", "(S)")):
+        return file_name[:-3].rstrip()
+    return file_name
 
 
 class PaperSize(Enum):
@@ -24,6 +39,13 @@ class PaperSize(Enum):
     A4 = (595, 842)
 
 
+# Flush the output writer to a temp file after this many pages to bound memory use
+WRITER_FLUSH_PAGE_COUNT = 100
+
+# Fixed annotation keys/values, hoisted so NameObject parsing is not repeated per annotation
+ANNOT_OPEN_KEY = pypdf.generic.NameObject("/Open")
+ANNOT_OPEN_FALSE = pypdf.generic.BooleanObject(False)
+
 MIN_LEFT_MARGIN = 18  # 0.25 in. margin
 MIN_RIGHT_MARGIN = 18
 MIN_TOP_MARGIN = 18
@@ -40,12 +62,14 @@ def extract_spell_name(spell_path: str):
     :param spell_path: path to a potential individual spell card .pdf file
     :return: the spell name in lowercase, or None
     """
-    file_name, ext = os.path.splitext(os.path.basename(spell_path))
+    if not spell_path.endswith(".pdf"):
+        return None
 
-    if ext != ".pdf" or file_name.startswith("!"):
+    file_name = spell_path.rsplit(os.sep, 1)[-1]
+    if file_name.startswith("!"):
         return None
 
-    return spell_file_prefix_re.sub("", file_name).lower()
+    return strip_spell_file_prefix(file_name[:-4]).lower()
 
 
 def extract_monster_name(monster_path: str):
@@ -58,12 +82,14 @@ def extract_monster_name(monster_path: str):
     :param monster_path: path to a potential individual monster card .pdf file
     :return: the monster name in lowercase, or None
     """
-    file_name, ext = os.path.splitext(os.path.basename(monster_path))
+    if not monster_path.endswith(".pdf"):
+        return None
 
-    if ext != ".pdf" or file_name.startswith("!"):
+    file_name = monster_path.rsplit(os.sep, 1)[-1]
+    if file_name.startswith("!"):
         return None
 
-    return monster_file_suffix_re.sub("", file_name).lower()
+    return strip_monster_file_suffix(file_name[:-4]).lower()
 
 
 def extract_card_name(card_path: str):
@@ -74,32 +100,79 @@ def extract_card_name(card_path: str):
     :param card_path: path to a potential individual card .pdf file
     :return: the card name in lowercase, or None
     """
-    file_name, ext = os.path.splitext(os.path.basename(card_path))
+    if not card_path.endswith(".pdf"):
+        return None
 
-    if ext != ".pdf" or file_name.startswith("!"):
+    file_name = card_path.rsplit(os.sep, 1)[-1]
+    if file_name.startswith("!"):
         return None
 
-    return file_name.lower()
+    return file_name[:-4].lower()
+
+
+def open_pdf_reader(path_to_pdf: str) -> pypdf.PdfReader:
+    """
+    Open a pdf through a read-only memory map, so pypdf's many small seeks and reads
+    are served from the kernel page cache instead of going through buffered file I/O.
+
+    :param path_to_pdf: path to the pdf file to open
+    :return: a PdfReader backed by the mapped file
+    """
+    with open(path_to_pdf, "rb") as f:
+        mapped_pdf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return pypdf.PdfReader(mapped_pdf)
 
 
 @dataclass()
 class CardInfo:
     path_to_pdf: str
-    card_size: Tuple[Decimal, Decimal]  # (W,H)
+    card_size: Tuple[float, float]  # (W,H)
+    reader: Optional[pypdf.PdfReader] = None
+    page: Optional[pypdf.PageObject] = None
+
+    def get_page(self) -> Optional[pypdf.PageObject]:
+        """
+        Return page 0 of the card pdf, opening and memoizing the reader on first use.
+
+        Returns None for pdfs that turn out not to be a single page, holding cards
+        assumed usable by the size cache or uniform-size fast paths to the same
+        contract as make_card_info.
+        """
+        if self.page is None:
+            if self.reader is None:
+                self.reader = open_pdf_reader(self.path_to_pdf)
+
+            if len(self.reader.pages) != 1:
+                return None
+
+            self.page = self.reader.pages[0]
+
+            actual_size = (
+                float(self.page.mediabox.width),
+                float(self.page.mediabox.height),
+            )
+            if actual_size != self.card_size:
+                logger.warning(
+                    f"Card {self.path_to_pdf} has size {actual_size}, not the assumed "
+                    f"{self.card_size}; using the actual size"
+                )
+                self.card_size = actual_size
+        return self.page
 
 
 def make_card_info(path_to_pdf: str) -> Optional[CardInfo]:
-    file_reader = pdf.PdfFileReader(open(path_to_pdf, "rb"))
-    if file_reader.getNumPages() != 1:
+    file_reader = open_pdf_reader(path_to_pdf)
+    if len(file_reader.pages) != 1:
         return None
 
-    card_page = file_reader.getPage(0)
+    card_page = file_reader.pages[0]
     card_size = (
-        card_page.mediaBox.getWidth(),
-        card_page.mediaBox.getHeight(),
+        float(card_page.mediabox.width),
+        float(card_page.mediabox.height),
     )
 
-    return CardInfo(path_to_pdf, card_size)
+    return CardInfo(path_to_pdf, card_size, file_reader, card_page)
 
 
 @dataclass()
@@ -108,11 +181,40 @@ class PageLayout:
     cards_per_page: int
     card_rows: int
     card_cols: int
-    card_height: Decimal
-    card_width: Decimal
-    card_scale: Decimal
-    left_margin: Decimal
-    bottom_margin: Decimal
+    card_height: float
+    card_width: float
+    card_scale: float
+    left_margin: float
+    bottom_margin: float
+
+    def card_placements(
+        self, card_count: int
+    ) -> List[Tuple[bool, Tuple[float, float, float, float, float, float]]]:
+        """
+        Precompute the placement of card_count cards in a single pass.
+
+        Cards are never rotated (paper orientation is chosen by the layout), so each
+        placement matrix is simply (scale, 0, 0, scale, tx, ty), built here so the
+        merge loop appends it without any per-card matrix assembly.
+
+        :param card_count: number of same-sized cards to place
+        :return: a (starts_new_page, ctm) tuple per card, in placement order
+        """
+        placements = []
+        for card_ct in range(card_count):
+            page_position = card_ct % self.cards_per_page
+            tx = self.left_margin + page_position % self.card_cols * self.card_width
+            ty = (
+                self.bottom_margin
+                + page_position // self.card_cols * self.card_height
+            )
+            placements.append(
+                (
+                    page_position == 0,
+                    (self.card_scale, 0, 0, self.card_scale, tx, ty),
+                )
+            )
+        return placements
 
 
 class CardMerger:
@@ -129,36 +231,89 @@ class CardMerger:
         """
         self.paper_size = PaperSize.LETTER
         self.name_filter = name_filter
+        self.card_paths: Dict[str, str] = {}
         self.card_dict: Dict[str:CardInfo] = {}
-        self.card_scale = Decimal(1.0)
+        self.card_scale = 1.0
+        # Every merged card is parsed exactly once per run either way; this only
+        # controls whether sizes are established eagerly in resolve_cards (off) or
+        # assumed from one reference card and corrected at page-open time (on).
+        self.assume_uniform_size = True
 
         self.create_card_pdf_dict(path_to_card_pdfs)
 
     def create_card_pdf_dict(self, path_to_pdf_directory: str):
         """
-        Create a card lookup dict given a path to a directory containing card pdfs.
+        Create a card name -> path lookup dict given a path to a directory containing card pdfs.
 
-        This will also configure layout based on the size of cards in the directory.
+        Card pdfs themselves are not opened here; they are parsed on demand once a card
+        list has been intersected with the directory contents.
 
         :param path_to_pdf_directory: a directory containing individual card files.
         :return:
         """
-        card_names = {
-            card_name: card_path
-            for card_path in glob.iglob(f"{path_to_pdf_directory}/*.pdf")
-            for card_name in [self.name_filter(card_path)]
-            if card_name
-        }
+        try:
+            with os.scandir(path_to_pdf_directory) as dir_entries:
+                self.card_paths = {
+                    card_name: entry.path
+                    for entry in dir_entries
+                    if entry.name.endswith(".pdf") and entry.is_file()
+                    for card_name in [self.name_filter(entry.name)]
+                    if card_name
+                }
+        except OSError as scan_error:
+            logger.error(
+                f"Could not read card pdf directory {path_to_pdf_directory}: {scan_error}"
+            )
+            self.card_paths = {}
 
-        self.card_dict = {
-            card_name: card_info
-            for card_name, card_path in card_names.items()
-            for card_info in [make_card_info(card_path)]
-            if card_info
-        }
+    def resolve_cards(self, card_names: Collection[str]) -> List[str]:
+        """
+        Parse the card pdfs for the given card names, memoizing results in card_dict.
+
+        With assume_uniform_size set, at most one unresolved card is parsed here and
+        the remaining cards are assumed to share its size (corrected lazily when
+        their pages open); otherwise unresolved cards fan out over a thread pool so
+        file reads overlap. Either way each card is fully parsed once per run — here
+        or at page-open time — so the flag changes when sizes are learned, not how
+        much work is done.
+
+        :param card_names: card names present in card_paths
+        :return: the names that resolved to usable (single page) card pdfs; cards
+            assumed via the uniform-size path are verified once their pages are opened
+        """
+        unresolved = [name for name in card_names if name not in self.card_dict]
+
+        if self.assume_uniform_size and unresolved:
+            reference_size = next(
+                (info.card_size for info in self.card_dict.values() if info), None
+            )
+            if reference_size is None:
+                # Parse one card to establish the archive's card size
+                name = unresolved.pop(0)
+                card_info = make_card_info(self.card_paths[name])
+                self.card_dict[name] = card_info
+                if card_info:
+                    reference_size = card_info.card_size
+
+            if reference_size:
+                # Assume the rest match; get_page() checks the real size lazily
+                for name in unresolved:
+                    self.card_dict[name] = CardInfo(
+                        self.card_paths[name], reference_size
+                    )
+                unresolved = []
+
+        if unresolved:
+            with ThreadPoolExecutor() as executor:
+                card_infos = executor.map(
+                    make_card_info, [self.card_paths[name] for name in unresolved]
+                )
+                self.card_dict.update(zip(unresolved, card_infos))
+
+        return [name for name in card_names if self.card_dict[name]]
 
     def determine_page_layout(
-        self, original_card_size: Tuple[Decimal, Decimal]
+        self, original_card_size: Tuple[float, float]
     ) -> Optional[PageLayout]:
         """
         Create a layout for same sized cards arranged on a page.  If cards will not fit, returns None
@@ -266,13 +421,11 @@ class CardMerger:
         :param cards: a vetted (all present in card_dict) set of cards to group
         :return: List of same-sized card lists
         """
-        card_infos = [self.card_dict[card] for card in cards]
-        card_sizes = {card_info.card_size for card_info in card_infos}
-        grouped_cards = [
-            [card_info for card_info in card_infos if card_info.card_size == size]
-            for size in card_sizes
-        ]
-        return grouped_cards
+        grouped_cards = defaultdict(list)
+        for card in cards:
+            card_info = self.card_dict[card]
+            grouped_cards[card_info.card_size].append(card_info)
+        return list(grouped_cards.values())
 
     def create_cards_file(self, path_to_card_list: str):
         """
@@ -296,81 +449,97 @@ class CardMerger:
         pdf_name = list_base_name + ".pdf"
 
         with open(path_to_card_list) as f:
-            card_set = {
-                line.rstrip().lower()
-                for line in f
-                if not line.startswith(("!", "#", "/")) and not line.isspace()
-            }
+            card_lines = f.read().lower().splitlines()
 
-        known_cards = card_set & self.card_dict.keys()
+        skip_chars = {"!", "#", "/"}
+        card_set = {
+            card_name
+            for line in card_lines
+            if (card_name := line.strip()) and card_name[0] not in skip_chars
+        }
 
-        unknown_cards = card_set - self.card_dict.keys()
+        known_cards = card_set & self.card_paths.keys()
+
+        unknown_cards = card_set - self.card_paths.keys()
 
         if unknown_cards:
             logger.warning(f"Could not find the following {len(unknown_cards)} cards:")
             logger.warning(pprint.pformat(unknown_cards))
 
-        if len(known_cards) == 0:
-            logger.error(f"No known cards.  Quitting.")
-            return
-
-        grouped_cards = self.group_cards_by_sizes(known_cards)
-
-        pdf_writer = pdf.PdfFileWriter()
-
-        for card_group in grouped_cards:
-            original_card_size = card_group[0].card_size
-            page_layout = self.determine_page_layout(original_card_size)
+        resolved_cards = self.resolve_cards(known_cards)
+
+        # Open and parse card pdfs in parallel up front so reads overlap; the writer
+        # loop below must stay serial because PdfWriter is not thread-safe. Opening
+        # also weeds out multi-page pdfs the size cache or uniform-size fast paths
+        # only assumed were usable.
+        with ThreadPoolExecutor() as executor:
+            list(
+                executor.map(
+                    CardInfo.get_page,
+                    (self.card_dict[name] for name in resolved_cards),
+                )
+            )
 
-            for card_ct, card in enumerate(card_group):
-                page_position = card_ct % page_layout.cards_per_page
-                row_no = page_position // page_layout.card_cols
-                col_no = page_position % page_layout.card_cols
+        usable_cards = [
+            name for name in resolved_cards if self.card_dict[name].get_page()
+        ]
 
-                if page_position == 0:
-                    current_page = pdf_writer.addBlankPage(
-                        width=page_layout.paper_size[0],
-                        height=page_layout.paper_size[1],
-                    )
+        unusable_cards = known_cards - set(usable_cards)
+        if unusable_cards:
+            logger.warning(
+                f"Skipping the following {len(unusable_cards)} multi-page card pdfs:"
+            )
+            logger.warning(pprint.pformat(unusable_cards))
 
-                card_page = pdf.PdfFileReader(open(card.path_to_pdf, "rb")).getPage(0)
-
-                tx = page_layout.left_margin + col_no * page_layout.card_width
-                ty = page_layout.bottom_margin + row_no * page_layout.card_height
-                rotation = 0
-
-                # Fix offsets of any annotations (Generating new cards from editable templates creates annotations)
-                if "/Annots" in card_page:
-                    for annot_indirect in card_page.get("/Annots").getObject():
-                        annot = annot_indirect.getObject()
-                        if "/Rect" in annot:
-                            bounding_rect = annot["/Rect"].getObject()
-
-                            annot.update(
-                                {
-                                    PyPDF2.generic.NameObject(
-                                        "/Open"
-                                    ): PyPDF2.generic.BooleanObject(False),
-                                    PyPDF2.generic.NameObject(
-                                        "/Rect"
-                                    ): PyPDF2.generic.RectangleObject(
-                                        [
-                                            bounding_rect[0]*page_layout.card_scale + tx,
-                                            bounding_rect[1]*page_layout.card_scale + ty,
-                                            bounding_rect[2]*page_layout.card_scale + tx,
-                                            bounding_rect[3]*page_layout.card_scale + ty,
-                                        ]
-                                    ),
-                                }
-                            )
-
-                current_page.mergeRotatedScaledTranslatedPage(
-                    card_page,
-                    rotation=rotation,
-                    scale=page_layout.card_scale,
-                    tx=tx,
-                    ty=ty,
-                )
+        if len(usable_cards) == 0:
+            logger.error(f"No known cards.  Quitting.")
+            return
 
-        with open(pdf_name, "wb") as out_stream:
-            pdf_writer.write(out_stream)
+        grouped_cards = self.group_cards_by_sizes(usable_cards)
+
+        pdf_writer = pypdf.PdfWriter()
+        flushed_parts: List[str] = []
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            def flush_writer():
+                nonlocal pdf_writer
+                part_path = os.path.join(temp_dir, f"part_{len(flushed_parts)}.pdf")
+                with open(part_path, "wb") as part_stream:
+                    pdf_writer.write(part_stream)
+                flushed_parts.append(part_path)
+                pdf_writer = pypdf.PdfWriter()
+
+            for card_group in grouped_cards:
+                original_card_size = card_group[0].card_size
+                page_layout = self.determine_page_layout(original_card_size)
+                card_placements = page_layout.card_placements(len(card_group))
+
+                for card, (starts_new_page, ctm) in zip(card_group, card_placements):
+                    if starts_new_page:
+                        if len(pdf_writer.pages) >= WRITER_FLUSH_PAGE_COUNT:
+                            flush_writer()
+                        current_page = pdf_writer.add_blank_page(
+                            width=page_layout.paper_size[0],
+                            height=page_layout.paper_size[1],
+                        )
+
+                    card_page = card.get_page()
+
+                    # pypdf clones annotations and applies the CTM to their rects when
+                    # merging into a writer page; just make sure popups start closed
+                    # (Generating new cards from editable templates creates annotations)
+                    if "/Annots" in card_page:
+                        for annot_indirect in card_page.get("/Annots").get_object():
+                            annot_indirect.get_object()[ANNOT_OPEN_KEY] = ANNOT_OPEN_FALSE
+
+                    current_page.merge_transformed_page(card_page, ctm)
+
+            if flushed_parts:
+                # Concatenate the flushed parts plus whatever is still in memory
+                flush_writer()
+                for part_path in flushed_parts:
+                    pdf_writer.append(part_path)
+
+            with open(pdf_name, "wb") as out_stream:
+                pdf_writer.write(out_stream)